@@ -1,10 +1,12 @@
 import os
 import tempfile
 import json
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, jsonify, Response
 from groq import Groq
 from dotenv import load_dotenv
 
+from model_router import ModelRouter, check_latency_target
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -17,32 +19,47 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     print("Warning: GROQ_API_KEY not found. API calls will fail.")
 
+# Picks the STT/chat model and reply length for each request from the tier
+# lists in STT_MODEL_TIERS / CHAT_MODEL_TIERS (see model_router.py).
+router = ModelRouter()
+
 @app.route('/')
 def index():
     """Renders the main HTML page."""
     return render_template('index.html')
 
-def get_groq_response(prompt):
-    """Gets a chat completion from the Groq API."""
+@app.route('/metrics')
+def metrics():
+    """Exports the model router decisions and latencies for Prometheus."""
+    return Response(router.metrics(), mimetype='text/plain; version=0.0.4')
+
+def get_groq_response(prompt, turn=None):
+    """Gets a chat completion from the Groq API within the request's latency budget."""
     if not GROQ_API_KEY:
         return "Sorry, I can't talk right now. My API key is missing on the server."
     
     client = Groq(api_key=GROQ_API_KEY)
+
+    deadline = turn.deadline if turn else router.deadline()
+    model, max_tokens = router.route_chat(deadline)
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a friendly and helpful character in a video game named Ursy. Keep your responses concise and conversational."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama-3.1-8b-instant"
-        )
+        with router.timed("chat", model, max_tokens, turn) as call:
+            chat_completion = client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a friendly and helpful character in a video game named Ursy. Keep your responses concise and conversational."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                model=model,
+                max_tokens=max_tokens
+            )
+            call.units = chat_completion.usage.completion_tokens
         return chat_completion.choices[0].message.content
     except Exception as e:
         print(f"Groq LLM API Error: {e}")
@@ -51,11 +68,30 @@ def get_groq_response(prompt):
 @app.route('/process_audio', methods=['POST'])
 def process_audio():
     """Receives audio blob, transcribes it, and generates an LLM response."""
+    # Invalid requests are rejected before the turn starts so they stay out of the SLO
     if 'audio_file' not in request.files:
         return jsonify({"error": "No audio file provided"}), 400
     
     audio_file = request.files['audio_file']
-    
+
+    # Optional per-request latency target, e.g. latency_target_ms=2000
+    latency_target_ms = None
+    if 'latency_target_ms' in request.form:
+        try:
+            latency_target_ms = float(request.form['latency_target_ms'])
+            check_latency_target(latency_target_ms)
+        except ValueError:
+            return jsonify({"error": "latency_target_ms must be a positive number"}), 400
+
+    # Server-side failures (5xx) count as failed turns
+    with router.turn(latency_target_ms) as turn:
+        response = app.make_response(handle_audio_turn(audio_file, turn))
+        if response.status_code >= 500:
+            turn.failed = True
+        return response
+
+def handle_audio_turn(audio_file, turn):
+    """Transcribes the uploaded audio and answers it within the turn's deadline."""
     if not GROQ_API_KEY:
         return jsonify({"error": "Server API key is missing."}), 500
 
@@ -72,11 +108,14 @@ def process_audio():
 
         # 2. Transcribe the audio file using Groq Whisper
         with open(temp_file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(os.path.basename(temp_file_path), file.read()),
-                model="whisper-large-v3",
-                response_format="json",
-            )
+            audio_data = file.read()
+            stt_model = router.route_stt(len(audio_data), turn.deadline)
+            with router.timed("stt", stt_model, len(audio_data) / 1024, turn):
+                transcription = client.audio.transcriptions.create(
+                    file=(os.path.basename(temp_file_path), audio_data),
+                    model=stt_model,
+                    response_format="json",
+                )
             user_prompt = transcription.text.strip()
             
             if not user_prompt:
@@ -86,7 +125,7 @@ def process_audio():
                 })
 
         # 3. Get LLM response
-        llm_response = get_groq_response(user_prompt)
+        llm_response = get_groq_response(user_prompt, turn)
 
         return jsonify({
             "user_prompt": user_prompt,
@@ -1,25 +1,100 @@
-import ursina
-from ursina import *
-import sounddevice as sd
-import numpy as np
+import importlib
+import sys
 import threading
 import tempfile
 import time
 import os
-import pyttsx3
-import groq
 from queue import Queue
 
+# Measured before ursina is imported so the profile covers the whole startup
+START_TIME = time.perf_counter()
+
+import ursina
+from ursina import *
+
 from dotenv import load_dotenv
 load_dotenv()
 
+from model_router import ModelRouter
+
 # --- IMPORTANT SETUP ---
 # Replace with your actual Groq API key.
 # It is highly recommended to use environment variables for this.
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# Picks the STT/chat model and reply length per turn (see model_router.py).
+router = ModelRouter()
+
+# --- STARTUP PROFILE ---
+# Run with --profile (or PROFILE_STARTUP=1) to print when the window, the
+# first frame and each lazily loaded subsystem became ready, plus the delay
+# between the first click and the microphone actually recording.
+# For a per-module breakdown, combine with: python -X importtime main.py
+PROFILE_STARTUP = "--profile" in sys.argv or bool(os.getenv("PROFILE_STARTUP"))
+profile_lock = threading.Lock()
+
+def profile_mark(label, since=None):
+    """Prints a startup profile line when profiling is enabled."""
+    if not PROFILE_STARTUP:
+        return
+    now = time.perf_counter()
+    with profile_lock:
+        line = f"[profile] {now - START_TIME:8.3f}s  {label}"
+        if since is not None:
+            line += f" ({now - since:.3f}s)"
+        print(line, flush=True)
+
+profile_mark("ursina imported")
+
+# --- LAZY SUBSYSTEMS ---
+# Audio, TTS and API modules are slow to import, so they are not loaded at
+# startup. warm_up() imports them on a background thread once the first frame
+# has been rendered; load_module() returns them immediately if the warm-up already
+# finished, or imports them on the spot if the player is faster.
+HEAVY_MODULES = ("sounddevice", "scipy.io.wavfile", "groq", "pyttsx3")
+
+def load_module(name):
+    """Imports a heavy module on first use and returns it."""
+    # import_module() waits for an import already running on another thread,
+    # so a half-initialised module is never returned
+    loaded = name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    if not loaded:
+        profile_mark(f"loaded {name}", since=started)
+    return module
+
+groq_client = None
+groq_client_lock = threading.Lock()
+
+def get_groq_client():
+    """Returns a shared Groq client so its HTTP connection pool is reused."""
+    global groq_client
+    with groq_client_lock:
+        if groq_client is None:
+            groq = load_module("groq")
+            groq_client = groq.Groq(api_key=GROQ_API_KEY)
+        return groq_client
+
+def warm_up():
+    """Loads the heavy subsystems in the background before the first conversation."""
+    started = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            load_module(name)
+        except Exception as e:
+            # The conversation will surface the real error when it needs it
+            print(f"Warm-up Error ({name}): {e}")
+    if GROQ_API_KEY and GROQ_API_KEY != "YOUR_GROQ_API_KEY_HERE":
+        try:
+            get_groq_client()
+        except Exception as e:
+            print(f"Warm-up Error (groq client): {e}")
+    profile_mark("warm-up complete", since=started)
+
 # --- GLOBAL VARIABLES & ENGINE SETUP ---
 app = Ursina(title="LLM Character Demo", borderless=False)
+profile_mark("window created")
 
 # Ursina entities for the UI
 status_text = Text(text="Click the button to talk to me!", origin=(0, 0), scale=2, y=0.3, background=True)
@@ -43,44 +118,62 @@ EditorCamera(parent=character)
 # A queue to pass updates from the background thread to the main thread
 update_queue = Queue()
 
+# Number of update() calls so far, used to start the warm-up after the first frame
+frames_updated = 0
+# perf_counter() of the last click, used to profile the delay until recording
+click_time = None
+
 # --- AUDIO & API PROCESSING FUNCTIONS ---
 
 # Function to record audio from the microphone
 def record_audio():
     """Records audio from the microphone for a set duration."""
-    update_queue.put(("status", "Listening..."))
-    
-    # Recording parameters
-    samplerate = 16000
-    duration = 5
-    
-    recording = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype='int16')
-    sd.wait()
-    
-    temp_audio_file = tempfile.mktemp(suffix=".wav")
-    from scipy.io.wavfile import write
-    write(temp_audio_file, samplerate, recording)
-    
-    return temp_audio_file
+    global click_time
+    try:
+        # A missing PortAudio or scipy install surfaces here, not at startup
+        sd = load_module("sounddevice")
+        wavfile = load_module("scipy.io.wavfile")
+        update_queue.put(("status", "Listening..."))
+        
+        # Recording parameters
+        samplerate = 16000
+        duration = 5
+        
+        recording = sd.rec(int(duration * samplerate), samplerate=samplerate, channels=1, dtype='int16')
+        if click_time is not None:
+            profile_mark("recording started after click", since=click_time)
+            click_time = None
+        sd.wait()
+        
+        temp_audio_file = tempfile.mktemp(suffix=".wav")
+        wavfile.write(temp_audio_file, samplerate, recording)
+        
+        return temp_audio_file
+    except Exception as e:
+        update_queue.put(("status", f"Audio Error: {e}"))
+        print(f"Audio Error: {e}")
+        return None
 
 # Function to transcribe audio using Groq's Whisper API
-def transcribe_audio_with_groq(file_path):
+def transcribe_audio_with_groq(file_path, turn):
     """Transcribes an audio file to text using the Groq Whisper API."""
     update_queue.put(("status", "Transcribing..."))
     
     if not GROQ_API_KEY or GROQ_API_KEY == "YOUR_GROQ_API_KEY_HERE":
         update_queue.put(("status", "Error: Please set your Groq API key in the code."))
         return None
-
-    client = groq.Groq(api_key=GROQ_API_KEY)
     
     try:
+        client = get_groq_client()
         with open(file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(
-                file=(os.path.basename(file_path), file.read()),
-                model="whisper-large-v3",
-                response_format="json",
-            )
+            audio_data = file.read()
+            model = router.route_stt(len(audio_data), turn.deadline)
+            with router.timed("stt", model, len(audio_data) / 1024, turn):
+                transcription = client.audio.transcriptions.create(
+                    file=(os.path.basename(file_path), audio_data),
+                    model=model,
+                    response_format="json",
+                )
             transcript_text = transcription.text
             update_queue.put(("user_prompt", f"You: {transcript_text}"))
             return transcript_text
@@ -92,35 +185,39 @@ def transcribe_audio_with_groq(file_path):
         os.remove(file_path)
 
 # Function to get a response from the Groq LLM
-def get_groq_response(prompt):
-    """Gets a chat completion from the Groq API."""
+def get_groq_response(prompt, turn):
+    """Gets a chat completion from the Groq API within the turn's latency budget."""
     update_queue.put(("status", "Thinking..."))
 
     if not GROQ_API_KEY or GROQ_API_KEY == "YOUR_GROQ_API_KEY_HERE":
         update_queue.put(("status", "Error: Please set your Groq API key in the code."))
         return "Sorry, I can't talk right now. My API key is missing!"
     
-    client = groq.Groq(api_key=GROQ_API_KEY)
+    model, max_tokens = router.route_chat(turn.deadline)
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a friendly and helpful character in a video game. Your name is Ursy. Keep your responses concise and conversational."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            # Updated to a currently supported model
-            model="llama-3.1-8b-instant"
-        )
+        client = get_groq_client()
+        with router.timed("chat", model, max_tokens, turn) as call:
+            chat_completion = client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a friendly and helpful character in a video game. Your name is Ursy. Keep your responses concise and conversational."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                model=model,
+                max_tokens=max_tokens
+            )
+            call.units = chat_completion.usage.completion_tokens
         response_text = chat_completion.choices[0].message.content
         update_queue.put(("llm_response", f"Ursy: {response_text}"))
         return response_text
     except Exception as e:
+        turn.failed = True
         update_queue.put(("status", f"Groq API Error: {e}"))
         print(f"Groq API Error: {e}")
         return "I'm having trouble connecting to my brain right now. Please try again."
@@ -130,6 +227,7 @@ def speak_text(text):
     """Converts text to speech and plays the audio using pyttsx3."""
     update_queue.put(("status", "Speaking..."))
     try:
+        pyttsx3 = load_module("pyttsx3")
         engine = pyttsx3.init()
         engine.say(text)
         engine.runAndWait()
@@ -139,7 +237,10 @@ def speak_text(text):
 
 # Main conversation flow triggered by the button
 def start_conversation():
+    global click_time
     mic_button.disable()
+    if PROFILE_STARTUP:
+        click_time = time.perf_counter()
     
     thread = threading.Thread(target=process_conversation)
     thread.start()
@@ -150,12 +251,16 @@ def process_conversation():
         update_queue.put(("enable_button", True))
         return
         
-    user_prompt = transcribe_audio_with_groq(audio_file_path)
+    # The latency target covers the time from the end of recording to the reply
+    with router.turn() as turn:
+        user_prompt = transcribe_audio_with_groq(audio_file_path, turn)
+        if user_prompt is None:
+            turn.failed = True
+        elif user_prompt:
+            groq_response = get_groq_response(user_prompt, turn)
     if not user_prompt:
         update_queue.put(("enable_button", True))
         return
-
-    groq_response = get_groq_response(user_prompt)
     
     speak_text(groq_response)
     
@@ -164,6 +269,16 @@ def process_conversation():
 
 def update():
     """The main Ursina update loop, handles thread-safe UI updates."""
+    global frames_updated
+    # update() runs before a frame is rendered, so the second call is the
+    # first point where a frame is on screen; only then start the warm-up
+    # so its imports do not compete for the GIL with the first render.
+    if frames_updated < 2:
+        frames_updated += 1
+        if frames_updated == 2:
+            profile_mark("first frame")
+            threading.Thread(target=warm_up, daemon=True).start()
+
     if not update_queue.empty():
         message_type, value = update_queue.get()
         if message_type == "status":
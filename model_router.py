@@ -0,0 +1,345 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# --- LATENCY-AWARE MODEL ROUTING ---
+# Picks the speech-to-text and chat model for each request from an ordered
+# tier list (preferred first, fastest last). Every call is timed, and the
+# rolling p95 and error rate per model decide whether a tier is healthy and
+# whether it can answer within the request's latency target.
+
+# Tier lists are "model" or "model:max_p95_ms" entries separated by commas.
+# A tier whose observed p95 rises above its max_p95_ms, or whose error rate
+# rises above MAX_ERROR_RATE, is skipped. Once every PROBE_INTERVAL seconds a
+# skipped tier still gets one request as a probe, which adds a sample like any
+# other call. The tier is used again only once its rolling p95 and error rate
+# are back under their limits, i.e. once fresh good samples outweigh the bad
+# ones or the bad ones are older than WINDOW_SECONDS.
+DEFAULT_STT_TIERS = "whisper-large-v3:2000,whisper-large-v3-turbo"
+DEFAULT_CHAT_TIERS = "llama-3.1-8b-instant"
+
+# Default end-to-end latency target for one conversation turn (STT + chat).
+DEFAULT_LATENCY_TARGET_MS = 3000
+# Share of the latency target reserved for transcription.
+STT_BUDGET_SHARE = 0.4
+
+# Bounds for the reply length cap derived from the remaining budget.
+MIN_REPLY_TOKENS = 32
+MAX_REPLY_TOKENS = 256
+
+# Rolling window used for the per-model latency statistics.
+WINDOW_SIZE = 50
+WINDOW_SECONDS = 300
+
+# A tier is unhealthy once this share of its recent calls failed, counted
+# only after MIN_ERROR_CALLS calls so a single failure does not drop it.
+MAX_ERROR_RATE = 0.5
+MIN_ERROR_CALLS = 3
+# Likewise, p95 only marks a tier degraded once it has this many samples, so
+# one slow cold-start call does not drop the preferred tier.
+MIN_LATENCY_SAMPLES = 5
+# Seconds between probe requests sent to an unhealthy tier.
+PROBE_INTERVAL = 30
+
+
+def parse_tiers(spec):
+    """Parses a "model[:max_p95_ms],..." string into (model, max_p95_s) tuples."""
+    tiers = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, limit = entry.partition(":")
+        max_p95 = float(limit) / 1000 if limit else None
+        tiers.append((model.strip(), max_p95))
+    if not tiers:
+        raise ValueError(f"Empty model tier list: {spec!r}")
+    return tiers
+
+
+def check_latency_target(latency_target_ms):
+    """Raises ValueError unless the latency target is a finite positive number."""
+    if not math.isfinite(latency_target_ms) or latency_target_ms <= 0:
+        raise ValueError("latency_target_ms must be a positive number")
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    index = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+class ModelStats:
+    """Rolling latency samples and call outcomes for one model."""
+
+    def __init__(self):
+        # Each sample is (timestamp, latency_seconds, units), where units is the
+        # input size for STT (audio KB) or the generated tokens for chat. Only
+        # successful calls are sampled; a fast failure says nothing about speed.
+        self.samples = deque(maxlen=WINDOW_SIZE)
+        # Each outcome is (timestamp, failed) for every call, used for the error rate.
+        self.outcomes = deque(maxlen=WINDOW_SIZE)
+        self.errors = 0
+        # Time the tier was last probed, or first seen unhealthy; None while healthy
+        self.last_probe = None
+
+    def add(self, latency, units):
+        now = time.monotonic()
+        self.samples.append((now, latency, units))
+        self.outcomes.append((now, False))
+
+    def add_error(self):
+        self.outcomes.append((time.monotonic(), True))
+        self.errors += 1
+
+    def prune(self):
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        for window in (self.samples, self.outcomes):
+            while window and window[0][0] < cutoff:
+                window.popleft()
+
+    def error_rate(self):
+        if len(self.outcomes) < MIN_ERROR_CALLS:
+            return 0.0
+        return sum(failed for _, failed in self.outcomes) / len(self.outcomes)
+
+    def healthy(self, max_p95):
+        if max_p95 is not None and len(self.samples) >= MIN_LATENCY_SAMPLES and self.p95() > max_p95:
+            return False
+        return self.error_rate() <= MAX_ERROR_RATE
+
+    def p95(self):
+        if not self.samples:
+            return None
+        return percentile([latency for _, latency, _ in self.samples], 95)
+
+    def fit(self):
+        """Fits latency = overhead + per_unit * units over the window.
+
+        Returns (overhead, per_unit) in seconds, or None while there is not
+        enough spread in the samples to estimate the slope.
+        """
+        if len(self.samples) < 3:
+            return None
+        xs = [units for _, _, units in self.samples]
+        ys = [latency for _, latency, _ in self.samples]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        var_x = sum((x - mean_x) ** 2 for x in xs)
+        if var_x == 0:
+            return None
+        per_unit = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+        per_unit = max(per_unit, 0.0)
+        overhead = max(mean_y - per_unit * mean_x, 0.0)
+        return overhead, per_unit
+
+    def tail_margin(self):
+        """Returns the gap between p95 and mean latency, added to fitted predictions."""
+        mean_latency = sum(latency for _, latency, _ in self.samples) / len(self.samples)
+        return max(self.p95() - mean_latency, 0.0)
+
+    def predict(self, units):
+        """Predicts a pessimistic (p95-shifted) latency for an input of this size."""
+        fit = self.fit()
+        if fit is None:
+            return self.p95()
+        overhead, per_unit = fit
+        # Shift the fitted line up so the prediction reflects tail latency
+        return overhead + per_unit * units + self.tail_margin()
+
+    def units_within(self, budget):
+        """Returns the largest input size predict() keeps within budget, or None if unknown."""
+        fit = self.fit()
+        if fit is None or fit[1] == 0:
+            return None
+        overhead, per_unit = fit
+        return (budget - overhead - self.tail_margin()) / per_unit
+
+
+class Turn:
+    """One conversation turn, measured against its latency target."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        # Set when any step of the turn failed, even if the caller recovered
+        # with a fallback reply, so the turn is not counted as meeting the SLO.
+        self.failed = False
+
+
+class ModelRouter:
+    """Chooses models per request and exports the decisions as metrics."""
+
+    def __init__(self, stt_tiers=None, chat_tiers=None, latency_target_ms=None):
+        self.stt_tiers = parse_tiers(stt_tiers or os.getenv("STT_MODEL_TIERS", DEFAULT_STT_TIERS))
+        self.chat_tiers = parse_tiers(chat_tiers or os.getenv("CHAT_MODEL_TIERS", DEFAULT_CHAT_TIERS))
+        target_ms = latency_target_ms or float(os.getenv("LATENCY_TARGET_MS", DEFAULT_LATENCY_TARGET_MS))
+        self.default_target = target_ms / 1000
+        self.stats = {}
+        self.decisions = {}
+        self.slo = {"met": 0, "missed": 0, "error": 0}
+        self.lock = threading.Lock()
+
+    def _stats(self, kind, model):
+        key = (kind, model)
+        if key not in self.stats:
+            self.stats[key] = ModelStats()
+        return self.stats[key]
+
+    def _choose(self, kind, tiers, budget, units):
+        """Returns (model, reason) for the first healthy tier that fits the budget."""
+        with self.lock:
+            now = time.monotonic()
+            fastest = None
+            for index, (model, max_p95) in enumerate(tiers):
+                stats = self._stats(kind, model)
+                stats.prune()
+                if not stats.healthy(max_p95):
+                    if stats.last_probe is None:
+                        # Just turned unhealthy: the first probe waits a full interval
+                        stats.last_probe = now
+                    elif now - stats.last_probe >= PROBE_INTERVAL:
+                        stats.last_probe = now
+                        reason = "probe"
+                        break
+                    continue
+                stats.last_probe = None
+                predicted = stats.predict(units)
+                if predicted is None or predicted <= budget:
+                    reason = "preferred" if index == 0 else "fallback"
+                    break
+                if fastest is None or predicted < fastest[1]:
+                    fastest = (model, predicted)
+            else:
+                # Nothing fits: use whichever model is expected to finish
+                # first, or the last (fastest) tier if every tier is degraded.
+                model = fastest[0] if fastest else tiers[-1][0]
+                reason = "over_budget" if fastest else "degraded"
+            key = (kind, model, reason)
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+            return model, reason
+
+    def deadline(self, latency_target_ms=None):
+        """Returns the absolute monotonic deadline for a new request."""
+        if latency_target_ms is None:
+            return time.monotonic() + self.default_target
+        check_latency_target(latency_target_ms)
+        return time.monotonic() + latency_target_ms / 1000
+
+    @contextmanager
+    def turn(self, latency_target_ms=None):
+        """Tracks one conversation turn and records its SLO outcome on exit.
+
+        The turn counts as an error if the block raises or marks it failed.
+        """
+        turn = Turn(self.deadline(latency_target_ms))
+        try:
+            yield turn
+        except Exception:
+            turn.failed = True
+            raise
+        finally:
+            self.record_request(turn)
+
+    def route_stt(self, audio_bytes, deadline):
+        """Chooses the transcription model for an audio clip of the given size."""
+        budget = (deadline - time.monotonic()) * STT_BUDGET_SHARE
+        model, _ = self._choose("stt", self.stt_tiers, budget, audio_bytes / 1024)
+        return model
+
+    def route_chat(self, deadline):
+        """Chooses the chat model and the max_tokens cap that fits the remaining budget."""
+        budget = deadline - time.monotonic()
+        model, _ = self._choose("chat", self.chat_tiers, budget, MIN_REPLY_TOKENS)
+        with self.lock:
+            tokens = self._stats("chat", model).units_within(budget)
+        max_tokens = MAX_REPLY_TOKENS if tokens is None else int(tokens)
+        return model, max(MIN_REPLY_TOKENS, min(MAX_REPLY_TOKENS, max_tokens))
+
+    def record(self, kind, model, started, units=None, error=False):
+        """Records a finished call started at time.monotonic() `started`.
+
+        Failed calls only count towards the error rate, not the latency window.
+        """
+        latency = time.monotonic() - started
+        with self.lock:
+            stats = self._stats(kind, model)
+            if error:
+                stats.add_error()
+            else:
+                stats.add(latency, units)
+
+    @contextmanager
+    def timed(self, kind, model, units, turn=None):
+        """Times an upstream call and records it, as a failure if it raises.
+
+        Chat calls only know their size afterwards, so the yielded object's
+        `units` can be updated inside the block. A failure also marks `turn`.
+        """
+        call = SimpleNamespace(units=units)
+        started = time.monotonic()
+        try:
+            yield call
+        except Exception:
+            self.record(kind, model, started, error=True)
+            if turn is not None:
+                turn.failed = True
+            raise
+        self.record(kind, model, started, call.units)
+
+    def record_request(self, turn):
+        """Records whether a conversation turn failed, or met or missed its target."""
+        if turn.failed:
+            outcome = "error"
+        elif time.monotonic() <= turn.deadline:
+            outcome = "met"
+        else:
+            outcome = "missed"
+        with self.lock:
+            self.slo[outcome] += 1
+
+    def metrics(self):
+        """Renders the router state in the Prometheus text exposition format."""
+        lines = [
+            "# HELP model_router_decisions_total Models chosen by the router.",
+            "# TYPE model_router_decisions_total counter",
+        ]
+        with self.lock:
+            for (kind, model, reason), count in sorted(self.decisions.items()):
+                lines.append(f'model_router_decisions_total{{kind="{kind}",model="{model}",reason="{reason}"}} {count}')
+
+            lines += [
+                "# HELP model_router_latency_p95_seconds Rolling p95 latency per model.",
+                "# TYPE model_router_latency_p95_seconds gauge",
+            ]
+            for (kind, model), stats in sorted(self.stats.items()):
+                stats.prune()
+                p95 = stats.p95()
+                if p95 is not None:
+                    lines.append(f'model_router_latency_p95_seconds{{kind="{kind}",model="{model}"}} {p95:.4f}')
+
+            lines += [
+                "# HELP model_router_errors_total Failed upstream calls per model.",
+                "# TYPE model_router_errors_total counter",
+            ]
+            for (kind, model), stats in sorted(self.stats.items()):
+                lines.append(f'model_router_errors_total{{kind="{kind}",model="{model}"}} {stats.errors}')
+
+            lines += [
+                "# HELP model_router_error_rate Share of failed calls per model in the rolling window.",
+                "# TYPE model_router_error_rate gauge",
+            ]
+            for (kind, model), stats in sorted(self.stats.items()):
+                lines.append(f'model_router_error_rate{{kind="{kind}",model="{model}"}} {stats.error_rate():.4f}')
+
+            lines += [
+                "# HELP model_router_slo_requests_total Conversation turns that met or missed their latency target, or failed.",
+                "# TYPE model_router_slo_requests_total counter",
+            ]
+            for outcome, count in sorted(self.slo.items()):
+                lines.append(f'model_router_slo_requests_total{{outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,181 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+import model_router
+from model_router import ModelRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(model_router, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def call(router, clock, kind, model, latency, units=10, error=False):
+    """Simulates one upstream call taking `latency` seconds."""
+    started = clock.monotonic()
+    clock.advance(latency)
+    router.record(kind, model, started, units, error=error)
+
+
+def make_router():
+    return ModelRouter(stt_tiers="big:1000,fast", chat_tiers="llm", latency_target_ms=3000)
+
+
+def test_parse_tiers():
+    assert model_router.parse_tiers("a:1500, b") == [("a", 1.5), ("b", None)]
+    with pytest.raises(ValueError):
+        model_router.parse_tiers(" , ")
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert model_router.percentile(values, 95) == 95
+    assert model_router.percentile([7], 95) == 7
+
+
+def test_cold_start_prefers_first_tier(clock):
+    router = make_router()
+    assert router.route_stt(50_000, router.deadline()) == "big"
+
+
+def test_single_slow_sample_does_not_degrade(clock):
+    router = make_router()
+    call(router, clock, "stt", "big", 5.0)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "big"
+
+
+def test_fallback_on_p95_degradation(clock):
+    router = make_router()
+    for _ in range(model_router.MIN_LATENCY_SAMPLES):
+        call(router, clock, "stt", "big", 2.0)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "fast"
+    assert router.decisions[("stt", "fast", "fallback")] == 1
+
+
+def test_fallback_on_error_rate(clock):
+    router = make_router()
+    for _ in range(model_router.MIN_ERROR_CALLS):
+        call(router, clock, "stt", "big", 0.001, error=True)
+    assert router.route_stt(50_000, router.deadline()) == "fast"
+    # Failed calls must not enter the latency window
+    assert not router.stats[("stt", "big")].samples
+
+
+def test_probe_waits_full_interval_and_keeps_history(clock):
+    router = make_router()
+    for _ in range(model_router.MIN_LATENCY_SAMPLES):
+        call(router, clock, "stt", "big", 2.0)
+    # The first request after degrading does not probe
+    assert router.route_stt(50_000, router.deadline(60_000)) == "fast"
+
+    clock.advance(model_router.PROBE_INTERVAL - 1)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "fast"
+
+    clock.advance(1)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "big"
+    assert router.decisions[("stt", "big", "probe")] == 1
+
+    # A fast probe adds one sample but does not erase the slow ones
+    call(router, clock, "stt", "big", 0.1)
+    assert len(router.stats[("stt", "big")].samples) == model_router.MIN_LATENCY_SAMPLES + 1
+    assert router.route_stt(50_000, router.deadline(60_000)) == "fast"
+
+
+def test_recovers_once_slow_samples_age_out(clock):
+    router = make_router()
+    for _ in range(model_router.MIN_LATENCY_SAMPLES):
+        call(router, clock, "stt", "big", 2.0)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "fast"
+
+    clock.advance(model_router.WINDOW_SECONDS + 1)
+    assert router.route_stt(50_000, router.deadline(60_000)) == "big"
+    assert router.stats[("stt", "big")].last_probe is None
+
+
+def test_max_tokens_defaults_without_fit(clock):
+    router = make_router()
+    assert router.route_chat(router.deadline()) == ("llm", model_router.MAX_REPLY_TOKENS)
+
+
+def test_max_tokens_clamped_and_within_tail_budget(clock):
+    router = make_router()
+    # 0.2s overhead plus 10ms per token
+    for tokens in (20, 50, 100, 150, 200):
+        call(router, clock, "chat", "llm", 0.2 + 0.01 * tokens, units=tokens)
+
+    assert router.route_chat(router.deadline(60_000))[1] == model_router.MAX_REPLY_TOKENS
+    assert router.route_chat(router.deadline(100))[1] == model_router.MIN_REPLY_TOKENS
+
+    _, max_tokens = router.route_chat(router.deadline(2000))
+    assert model_router.MIN_REPLY_TOKENS < max_tokens < model_router.MAX_REPLY_TOKENS
+    assert router.stats[("chat", "llm")].predict(max_tokens) <= 2.0
+
+
+@pytest.mark.parametrize("target", [math.nan, math.inf, -math.inf, 0, -5])
+def test_deadline_rejects_invalid_targets(clock, target):
+    router = make_router()
+    with pytest.raises(ValueError):
+        router.deadline(target)
+
+
+def test_deadline_uses_default_target(clock):
+    router = make_router()
+    assert router.deadline() == clock.now + 3.0
+    assert router.deadline(500) == clock.now + 0.5
+
+
+def test_turn_outcomes(clock):
+    router = make_router()
+
+    with router.turn():
+        clock.advance(1.0)
+
+    with router.turn(100):
+        clock.advance(1.0)
+
+    with router.turn() as turn:
+        with pytest.raises(RuntimeError):
+            with router.timed("chat", "llm", 32, turn):
+                raise RuntimeError("upstream down")
+
+    with pytest.raises(KeyError):
+        with router.turn():
+            raise KeyError
+
+    assert router.slo == {"met": 1, "missed": 1, "error": 2}
+
+
+def test_timed_records_units_set_in_block(clock):
+    router = make_router()
+    with router.timed("chat", "llm", 256) as timed_call:
+        clock.advance(0.5)
+        timed_call.units = 40
+    assert list(router.stats[("chat", "llm")].samples) == [(clock.now, 0.5, 40)]
+
+
+def test_metrics_output(clock):
+    router = make_router()
+    router.route_stt(50_000, router.deadline())
+    call(router, clock, "stt", "big", 0.5)
+    with router.turn():
+        pass
+    text = router.metrics()
+    assert 'model_router_decisions_total{kind="stt",model="big",reason="preferred"} 1' in text
+    assert 'model_router_latency_p95_seconds{kind="stt",model="big"} 0.5000' in text
+    assert 'model_router_error_rate{kind="stt",model="big"} 0.0000' in text
+    assert 'model_router_slo_requests_total{outcome="met"} 1' in text